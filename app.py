@@ -2,42 +2,106 @@
 Emotion Diary App for middle school EFL students.
 
 Quick start:
-    pip install streamlit pandas google-genai
+    pip install streamlit pandas numpy pyarrow google-genai
     streamlit run app.py
 """
 
 from __future__ import annotations
 
+import csv
 import datetime as dt
+import hashlib
 import os
 import re
-from typing import Dict
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
 import streamlit as st
 from google import genai
 
 CSV_PATH = "diary_logs.csv"
 MODEL_NAME = "gemini-3-flash-preview"
+DIARY_COLUMNS = [
+    "timestamp",
+    "date",
+    "student_id",
+    "mood",
+    "original_diary",
+    "corrected_diary",
+    "feedback_en",
+    "summary_ko",
+]
+# 모든 컬럼을 문자열로 고정해 타입 추론을 건너뜀 (숫자만 있는 학생 ID도 문자열 유지)
+DIARY_SCHEMA = pa.schema([(col, pa.string()) for col in DIARY_COLUMNS])
+
+# 응답 섹션 헤더 (모듈 로드 시 한 번만 컴파일, 위치 탐색에만 사용)
+_CORRECTED_HEADER = re.compile(r"Corrected\s*Diary\s*:\s*", re.IGNORECASE)
+_FEEDBACK_HEADER = re.compile(r"Feedback\s*:\s*", re.IGNORECASE)
+_SUMMARY_HEADER = re.compile(r"Korean\s*Summary\s*:\s*", re.IGNORECASE)
+
+# API 키 형식 검사 (잘못된 키는 네트워크 요청 전에 걸러냄)
+_API_KEY_PATTERN = re.compile(r"[A-Za-z0-9_\-]{30,}")
+
+# 프롬프트는 학생 일기 앞뒤로 고정 (매 요청마다 동일한 prefix)
+_PROMPT_HEAD = '''
+You are an English teacher for middle school EFL students.
+The student wrote an English emotion diary.
+
+Please respond with these exact section headers:
+Corrected Diary:
+Feedback:
+Korean Summary:
+
+Rules:
+1) Rewrite the diary in correct and natural English, but do not change the meaning or level too much.
+2) Give friendly feedback in simple English (2-3 sentences, CEFR A2-B1 level).
+   - Show empathy for the student's feelings.
+   - Praise 1-2 good things about the writing.
+   - Suggest one small thing to improve next time.
+3) Write a one-sentence summary in Korean for the teacher.
 
+Student diary: """'''
+_PROMPT_TAIL = '"""\n'
 
+
+@st.cache_resource(show_spinner=False)
 def init_gemini_client(api_key: str):
-    """Initialize Gemini client with a user-provided API key."""
+    """Initialize Gemini client with a user-provided API key (reused across reruns)."""
     return genai.Client(api_key=api_key)
 
 
 def parse_feedback_response(text: str) -> Dict[str, str]:
     """Parse model output into structured sections with safe fallbacks."""
-    patterns = {
-        "corrected_diary": r"Corrected\s*Diary\s*:\s*(.*?)(?=Feedback\s*:|Korean\s*Summary\s*:|$)",
-        "feedback_en": r"Feedback\s*:\s*(.*?)(?=Korean\s*Summary\s*:|$)",
-        "summary_ko": r"Korean\s*Summary\s*:\s*(.*)$",
-    }
-
-    parsed: Dict[str, str] = {}
-    for key, pattern in patterns.items():
-        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-        parsed[key] = match.group(1).strip() if match else ""
+    # 헤더 단어가 하나도 없으면(자유 형식 응답) 헤더 탐색 없이 바로 fallback
+    lowered = text.lower()
+    if "corrected" not in lowered and "feedback" not in lowered and "korean" not in lowered:
+        return {"corrected_diary": text.strip(), "feedback_en": "", "summary_ko": ""}
+
+    parsed: Dict[str, str] = {"corrected_diary": "", "feedback_en": "", "summary_ko": ""}
+
+    # 각 섹션은 헤더 뒤부터 그 이후에 처음 나오는 다음 헤더(또는 끝)까지
+    corrected = _CORRECTED_HEADER.search(text)
+    if corrected:
+        start = corrected.end()
+        stops = [m.start() for m in (_FEEDBACK_HEADER.search(text, start), _SUMMARY_HEADER.search(text, start)) if m]
+        parsed["corrected_diary"] = text[start : min(stops, default=len(text))].strip()
+
+    feedback = _FEEDBACK_HEADER.search(text)
+    if feedback:
+        start = feedback.end()
+        stop = _SUMMARY_HEADER.search(text, start)
+        parsed["feedback_en"] = text[start : stop.start() if stop else len(text)].strip()
+
+    summary = _SUMMARY_HEADER.search(text)
+    if summary:
+        parsed["summary_ko"] = text[summary.end() :].strip()
 
     # 파싱 실패 시 전체 텍스트라도 보여주기
     if not parsed["corrected_diary"] and not parsed["feedback_en"] and not parsed["summary_ko"]:
@@ -46,36 +110,94 @@ def parse_feedback_response(text: str) -> Dict[str, str]:
     return parsed
 
 
-def generate_feedback(client, diary_text: str) -> Dict[str, str]:
-    """Call Gemini and return corrected diary, simple feedback, and Korean summary."""
-    prompt = f'''
-You are an English teacher for middle school EFL students.
-The student wrote an English emotion diary.
+def generate_feedback(
+    client, diary_text: str, on_text: Optional[Callable[[str], object]] = None
+) -> Dict[str, str]:
+    """Call Gemini and return corrected diary, simple feedback, and Korean summary.
 
-Please respond with these exact section headers:
-Corrected Diary:
-Feedback:
-Korean Summary:
+    The response is streamed; `on_text`, if given, receives the text received so far after each chunk.
+    """
+    prompt = "".join((_PROMPT_HEAD, diary_text, _PROMPT_TAIL))
 
-Rules:
-1) Rewrite the diary in correct and natural English, but do not change the meaning or level too much.
-2) Give friendly feedback in simple English (2-3 sentences, CEFR A2-B1 level).
-   - Show empathy for the student's feelings.
-   - Praise 1-2 good things about the writing.
-   - Suggest one small thing to improve next time.
-3) Write a one-sentence summary in Korean for the teacher.
-
-Student diary: """{diary_text}"""
-'''
-
-    response = client.models.generate_content(model=MODEL_NAME, contents=prompt)
-    raw_text = (response.text or "").strip()
+    chunks: List[str] = []
+    for chunk in client.models.generate_content_stream(model=MODEL_NAME, contents=prompt):
+        chunks.append(chunk.text or "")
+        if on_text is not None:
+            on_text("".join(chunks))
+    raw_text = "".join(chunks).strip()
 
     parsed = parse_feedback_response(raw_text)
     parsed["raw_response"] = raw_text
     return parsed
 
 
+def api_key_fingerprint(api_key: str) -> str:
+    """Return a short hash of the API key so the raw key never ends up in cache keys."""
+    return hashlib.blake2b(api_key.encode(), digest_size=8).hexdigest()
+
+
+def normalize_diary_key(diary_text: str) -> str:
+    """Collapse whitespace so diaries differing only in spacing/line breaks share a cache entry."""
+    return " ".join(diary_text.split())
+
+
+class FeedbackCache:
+    """Thread-safe LRU cache of parsed feedback with a time-to-live, shared across sessions."""
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3600.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[Tuple[str, ...], Tuple[float, Dict[str, str]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, ...]) -> Optional[Dict[str, str]]:
+        """Return a copy of the cached result, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(value)
+
+    def put(self, key: Tuple[str, ...], value: Dict[str, str]) -> None:
+        """Store a copy of the result, evicting the least recently used entries beyond the limit."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), dict(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@st.cache_resource(show_spinner=False)
+def get_feedback_cache() -> FeedbackCache:
+    """Return the process-wide feedback cache (survives reruns)."""
+    return FeedbackCache()
+
+
+def generate_feedback_cached(
+    api_key: str, diary_text: str, on_text: Optional[Callable[[str], object]] = None
+) -> Dict[str, str]:
+    """Return cached feedback for an equivalent diary; stream a fresh one from Gemini on a miss.
+
+    The cache key uses `api_key_fingerprint` (never the raw key), the model name and
+    `normalize_diary_key`; the original diary text is what actually gets sent on a miss.
+    Empty responses are not cached, so a retry asks Gemini again.
+    """
+    cache = get_feedback_cache()
+    key = (api_key_fingerprint(api_key), MODEL_NAME, normalize_diary_key(diary_text))
+    result = cache.get(key)
+    if result is None:
+        result = generate_feedback(init_gemini_client(api_key), diary_text, on_text=on_text)
+        # 빈 응답(차단/중단 등)은 캐시하지 않아 재시도 시 다시 요청
+        if result["raw_response"]:
+            cache.put(key, result)
+    return result
+
+
 def save_diary_to_csv(
     timestamp: str,
     selected_date: str,
@@ -87,47 +209,89 @@ def save_diary_to_csv(
     summary_ko: str,
     csv_path: str = CSV_PATH,
 ) -> None:
-    """Append one diary record to CSV; create file with headers if missing."""
-    row_df = pd.DataFrame(
-        [
-            {
-                "timestamp": timestamp,
-                "date": selected_date,
-                "student_id": student_id,
-                "mood": mood,
-                "original_diary": original_diary,
-                "corrected_diary": corrected_diary,
-                "feedback_en": feedback_en,
-                "summary_ko": summary_ko,
-            }
-        ]
-    )
+    """Append one diary record to CSV; write headers if the file is missing or empty."""
+    with open(csv_path, "a", newline="", encoding="utf-8-sig") as f:
+        # append 모드는 파일 끝에서 시작하므로, 위치가 0이면 새(빈) 파일 → 헤더 작성
+        writer = csv.writer(f)
+        if f.tell() == 0:
+            writer.writerow(DIARY_COLUMNS)
+        writer.writerow(
+            [timestamp, selected_date, student_id, mood, original_diary, corrected_diary, feedback_en, summary_ko]
+        )
 
-    file_exists = os.path.exists(csv_path)
-    row_df.to_csv(csv_path, mode="a", index=False, header=not file_exists, encoding="utf-8-sig")
 
+def diary_csv_version(csv_path: str = CSV_PATH) -> Tuple[int, int]:
+    """Return (mtime_ns, size) of the log file, or (0, 0) if it does not exist yet."""
+    try:
+        stat = os.stat(csv_path)
+    except FileNotFoundError:
+        return (0, 0)
+    return (stat.st_mtime_ns, stat.st_size)
 
-def load_diary_csv(csv_path: str = CSV_PATH) -> pd.DataFrame:
-    """Load diary CSV or return an empty DataFrame with expected columns."""
-    expected_cols = [
-        "timestamp",
-        "date",
-        "student_id",
-        "mood",
-        "original_diary",
-        "corrected_diary",
-        "feedback_en",
-        "summary_ko",
-    ]
 
-    if not os.path.exists(csv_path):
-        return pd.DataFrame(columns=expected_cols)
+@st.cache_data(show_spinner=False, max_entries=1)
+def load_diary_csv(version: Tuple[int, int], csv_path: str = CSV_PATH) -> pd.DataFrame:
+    """Load diary CSV or return an empty DataFrame with expected columns.
 
-    df = pd.read_csv(csv_path)
-    for col in expected_cols:
-        if col not in df.columns:
-            df[col] = ""
-    return df[expected_cols]
+    `version` (see `diary_csv_version`) is only part of the cache key: the file is re-read
+    only after it changes, and only the latest copy is kept in memory.
+    """
+    if not os.path.exists(csv_path):
+        return pd.DataFrame(columns=DIARY_COLUMNS)
+
+    # 고정 스키마로 Arrow CSV 리더 사용 (멀티스레드 파싱, 누락된 컬럼은 null로 채움)
+    # 일기/피드백에는 줄바꿈이 들어가므로, 블록 경계가 따옴표 값 안에서 잘리지 않도록 허용
+    table = pa_csv.read_csv(
+        csv_path,
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=DIARY_SCHEMA,
+            include_columns=DIARY_COLUMNS,
+            include_missing_columns=True,
+        ),
+    )
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    # 날짜 형식 변환
+    df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.date
+    return df
+
+
+@st.fragment
+def render_history() -> None:
+    """Render the history tab; reruns on its own when only the filter widgets change."""
+    st.subheader("Past Diary Records")
+    logs_df = load_diary_csv(diary_csv_version())
+
+    if logs_df.empty:
+        st.info("No records yet. / 아직 저장된 기록이 없습니다.")
+    else:
+        # 5) 필터 UI
+        col1, col2 = st.columns(2)
+        with col1:
+            filter_student = st.text_input("Filter by Name/ID", key="filter_student")
+        with col2:
+            min_date = logs_df["date"].min()
+            max_date = logs_df["date"].max()
+            date_range = st.date_input(
+                "Filter by Date Range",
+                value=(min_date, max_date) if pd.notna(min_date) and pd.notna(max_date) else (dt.date.today(), dt.date.today()),
+            )
+
+        # 조건을 불리언 마스크로 모아 마지막에 한 번만 행 선택 (전체 복사 없음)
+        mask = np.ones(len(logs_df), dtype=bool)
+        student_query = filter_student.strip()
+        if student_query:
+            # Arrow 컴퓨트 커널로 부분 문자열 검색 (대소문자 무시)
+            student_ids = pa.array(logs_df["student_id"], type=pa.string(), from_pandas=True)
+            matches = pc.match_substring(student_ids, student_query, ignore_case=True)
+            mask &= matches.fill_null(False).to_numpy(zero_copy_only=False)
+
+        if isinstance(date_range, tuple) and len(date_range) == 2:
+            start_date, end_date = date_range
+            mask &= ((logs_df["date"] >= start_date) & (logs_df["date"] <= end_date)).to_numpy()
+
+        st.dataframe(logs_df.loc[mask], use_container_width=True)
 
 
 def main() -> None:
@@ -139,7 +303,7 @@ def main() -> None:
 
     # 1) API 키 입력
     st.sidebar.header("🔐 Gemini API Settings")
-    api_key = st.sidebar.text_input("Enter your Gemini API key", type="password")
+    api_key = st.sidebar.text_input("Enter your Gemini API key", type="password").strip()
     if not api_key:
         st.sidebar.info("Please enter your Gemini API key to use the app. / API 키를 입력해주세요.")
 
@@ -149,48 +313,61 @@ def main() -> None:
     with diary_tab:
         st.subheader("Today's Emotion Diary")
 
-        # 2) 메인 입력 UI
-        selected_date = st.date_input("Date", value=dt.date.today())
-        student_input = st.text_input("Name or Student ID", placeholder="e.g., Mina-03")
-        student_id = student_input.strip() or "Anonymous"
+        # 2) 메인 입력 UI (폼으로 묶어 제출 전까지는 재실행하지 않음)
+        with st.form("diary_form", clear_on_submit=False):
+            selected_date = st.date_input("Date", value=dt.date.today())
+            student_input = st.text_input("Name or Student ID", placeholder="e.g., Mina-03")
 
-        mood = st.selectbox(
-            "Today's Mood",
-            ["😊 Happy", "😢 Sad", "😡 Angry", "😴 Tired", "😌 Calm", "🤩 Excited", "😐 So-so"],
-        )
+            mood = st.selectbox(
+                "Today's Mood",
+                ["😊 Happy", "😢 Sad", "😡 Angry", "😴 Tired", "😌 Calm", "🤩 Excited", "😐 So-so"],
+            )
 
-        diary_text = st.text_area(
-            "Write about your day and how you felt in English.",
-            height=180,
-            placeholder="Try writing 3-5 sentences in English...",
-        )
+            diary_text = st.text_area(
+                "Write about your day and how you felt in English.",
+                height=180,
+                placeholder="Try writing 3-5 sentences in English...",
+            )
+
+            submitted = st.form_submit_button("Save & Get Feedback", type="primary", use_container_width=True)
+
+        student_id = student_input.strip() or "Anonymous"
 
-        if st.button("Save & Get Feedback", type="primary", use_container_width=True):
+        if submitted:
             # 버튼 클릭 시점에만 호출/저장
             if not api_key:
                 st.error("Please enter your Gemini API key first. / 먼저 Gemini API 키를 입력해주세요.")
                 st.stop()
 
-            if not diary_text.strip():
+            if not _API_KEY_PATTERN.fullmatch(api_key):
+                st.error("Invalid API key format. Please check your key. / API 키 형식이 올바르지 않습니다.")
+                st.stop()
+
+            diary = diary_text.strip()
+            if not diary:
                 st.error("Please write your diary before submitting. / 일기를 먼저 작성해주세요.")
                 st.stop()
 
             try:
                 with st.spinner("Generating feedback... 잠시만 기다려주세요."):
-                    client = init_gemini_client(api_key)
-                    result = generate_feedback(client, diary_text.strip())
+                    # 생성 중인 응답을 실시간으로 표시하고, 완료 후 파싱된 결과로 교체
+                    stream_box = st.empty()
+                    result = generate_feedback_cached(api_key, diary, on_text=stream_box.markdown)
+                    stream_box.empty()
 
                     corrected_diary = result.get("corrected_diary", "")
                     feedback_en = result.get("feedback_en", "")
                     summary_ko = result.get("summary_ko", "")
 
                     # 3) CSV 저장
+                    timestamp = dt.datetime.now().isoformat(timespec="seconds")
+                    date_str = selected_date.isoformat()
                     save_diary_to_csv(
-                        timestamp=dt.datetime.now().isoformat(timespec="seconds"),
-                        selected_date=selected_date.isoformat(),
+                        timestamp=timestamp,
+                        selected_date=date_str,
                         student_id=student_id,
                         mood=mood,
-                        original_diary=diary_text.strip(),
+                        original_diary=diary,
                         corrected_diary=corrected_diary,
                         feedback_en=feedback_en,
                         summary_ko=summary_ko,
@@ -200,7 +377,7 @@ def main() -> None:
 
                 # 4) 결과 표시
                 st.subheader("Original Diary")
-                st.code(diary_text.strip(), language="markdown")
+                st.code(diary, language="markdown")
 
                 st.subheader("Corrected Diary")
                 st.markdown(corrected_diary or "(No parsed corrected diary)")
@@ -218,40 +395,7 @@ def main() -> None:
                 )
 
     with history_tab:
-        st.subheader("Past Diary Records")
-        logs_df = load_diary_csv()
-
-        if logs_df.empty:
-            st.info("No records yet. / 아직 저장된 기록이 없습니다.")
-        else:
-            # 날짜 형식 변환
-            logs_df["date"] = pd.to_datetime(logs_df["date"], errors="coerce").dt.date
-
-            # 5) 필터 UI
-            col1, col2 = st.columns(2)
-            with col1:
-                filter_student = st.text_input("Filter by Name/ID", key="filter_student")
-            with col2:
-                min_date = logs_df["date"].min()
-                max_date = logs_df["date"].max()
-                date_range = st.date_input(
-                    "Filter by Date Range",
-                    value=(min_date, max_date) if pd.notna(min_date) and pd.notna(max_date) else (dt.date.today(), dt.date.today()),
-                )
-
-            filtered_df = logs_df.copy()
-            if filter_student.strip():
-                filtered_df = filtered_df[
-                    filtered_df["student_id"].astype(str).str.contains(filter_student.strip(), case=False, na=False)
-                ]
-
-            if isinstance(date_range, tuple) and len(date_range) == 2:
-                start_date, end_date = date_range
-                filtered_df = filtered_df[
-                    (filtered_df["date"] >= start_date) & (filtered_df["date"] <= end_date)
-                ]
-
-            st.dataframe(filtered_df, use_container_width=True)
+        render_history()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,28 @@
+import app
+
+
+def test_load_diary_csv_multiline_values_beyond_one_block(tmp_path):
+    """Quoted multiline diary text must survive Arrow's block splitting (> 1 MB logs)."""
+    csv_path = str(tmp_path / "diary_logs.csv")
+    diary = "I was happy today.\nThen, I went home.\n" * 5
+    rows = 3000
+    for i in range(rows):
+        app.save_diary_to_csv(
+            timestamp="2026-10-15T09:00:00",
+            selected_date="2026-10-15",
+            student_id=f"S{i:04d}",
+            mood="😊 Happy",
+            original_diary=diary,
+            corrected_diary="I was happy.\nThen, I went home.",
+            feedback_en="Nice work!\nTry adding one more detail.",
+            summary_ko="학생은 행복한 하루를 보냈다.",
+            csv_path=csv_path,
+        )
+
+    assert tmp_path.joinpath("diary_logs.csv").stat().st_size > 1 << 20
+
+    df = app.load_diary_csv(app.diary_csv_version(csv_path), csv_path)
+    assert len(df) == rows
+    assert list(df.columns) == app.DIARY_COLUMNS
+    assert df["original_diary"].iloc[-1] == diary
+    assert df["student_id"].iloc[-1] == f"S{rows - 1:04d}"